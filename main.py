@@ -1,100 +1,364 @@
+from __future__ import annotations
+
 import asyncio
+import heapq
 import json
 import os
-from datetime import datetime, time, timedelta
-from typing import Dict, List
+import re
+import time
+from dataclasses import dataclass, field, fields
+from datetime import datetime, time as dt_time
 from astrbot.api.event import filter, AstrMessageEvent
 from astrbot.api.star import Context, Star, register
 from astrbot.api import logger
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_dumps(obj, indent: bool = False) -> bytes:
+    """序列化为UTF-8编码的JSON，优先使用orjson"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode('utf-8')
+
+
+def _json_loads(data: bytes):
+    """解析JSON，优先使用orjson"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# 管理命令解析：第一段为命令名本身
+_ADD_RE = re.compile(r'^\S+\s+(\d+)\s+(\S+)\s+(.+)$', re.DOTALL)
+_TIME_RE = re.compile(r'^(?:[01]\d|2[0-3]):[0-5]\d$')
+_DEL_RE = re.compile(r'^\S+\s+(\S+)\s*$')
+_TOGGLE_RE = _DEL_RE
+
+
+@dataclass(slots=True)
+class ScheduledMsg:
+    """单条定时消息配置"""
+    id: str
+    group_id: str
+    time: str
+    message: str
+    enabled: bool = True
+    created_at: str = ''
+    # 运行时缓存的(时, 分, 秒)，不持久化
+    clock: tuple[int, int, int] = field(init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        # 与旧版本一致按ISO格式解析，兼容 "0930"、"09:00:30" 等已保存的配置
+        parsed = dt_time.fromisoformat(self.time)
+        self.clock = (parsed.hour, parsed.minute, parsed.second)
+    
+    @classmethod
+    def from_dict(cls, data: dict) -> ScheduledMsg:
+        """从配置字典构建，忽略未知字段"""
+        return cls(**{k: data[k] for k in _PERSISTED_FIELDS if k in data})
+    
+    def to_dict(self) -> dict:
+        """转换为需要持久化的配置字典"""
+        return {k: getattr(self, k) for k in _PERSISTED_FIELDS}
+
+
+_PERSISTED_FIELDS = tuple(f.name for f in fields(ScheduledMsg) if f.init)
+
+
 @register("timed_message", "AstrBot开发者", "定时发送群聊消息插件", "1.0.0")
 class TimedMessagePlugin(Star):
     def __init__(self, context: Context):
         super().__init__(context)
         self.config_file = os.path.join(os.path.dirname(__file__), "timed_messages.json")
-        self.tasks: Dict[str, asyncio.Task] = {}
-        self.scheduled_messages: List[Dict] = []
+        self.journal_file = os.path.join(os.path.dirname(__file__), "timed_messages.jsonl")
+        # 按消息ID索引的定时消息配置
+        self.scheduled_messages: dict[str, ScheduledMsg] = {}
+        # 加载时无法解析的原始配置，原样保留并在压缩快照时写回，避免被静默删除
+        self._invalid_records: dict[str, dict] = {}
+        # 单一调度任务：按下次触发时间维护最小堆，只睡到最早的那一条。
+        # 与 aioscheduler 的 TimedScheduler 思路相同，但为保持插件无额外依赖而自行实现
+        self._heap: list[tuple[float, str]] = []
+        self._next_fire: dict[str, float] = {}
+        # 堆中已失效（被删除、禁用或重新调度）但尚未弹出的条目数
+        self._stale = 0
+        self._wake = asyncio.Event()
+        self._scheduler_task: asyncio.Task | None = None
+        # 正在发送中的消息任务，保留引用以免被回收，并在终止时取消
+        self._send_tasks: set[asyncio.Task] = set()
+        # 限制同时发送的消息数，避免同一时刻大量消息冲击接口
+        self._send_sem = asyncio.Semaphore(5)
+        # 按群号加锁：同一群的消息按触发顺序依次发送，不同群之间并行
+        self._group_locks: dict[str, asyncio.Lock] = {}
+        self._group_lock_users: dict[str, int] = {}
+        # 配置变更只置脏标记，由后台任务合并成一次写盘
+        self._dirty = asyncio.Event()
+        self._flusher_task: asyncio.Task | None = None
+        # 正在进行的写盘任务；取消后台任务不会中止工作线程，终止时需等待其完成
+        self._save_task: asyncio.Task | None = None
+        self._pending_deltas: list[dict] = []
+        self._journal_len = 0
         
     async def initialize(self):
         """插件初始化，加载配置并启动定时任务"""
         await self.load_config()
         await self.start_all_tasks()
+        self._flusher_task = asyncio.create_task(self._flusher())
         logger.info("定时消息插件初始化完成")
     
     async def load_config(self):
-        """加载定时消息配置"""
+        """加载定时消息配置：读取快照后重放增量日志"""
         try:
-            if os.path.exists(self.config_file):
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    self.scheduled_messages = json.load(f)
+            if os.path.exists(self.config_file) or os.path.exists(self.journal_file):
+                messages, deltas = await asyncio.to_thread(self._sync_load)
+                self.scheduled_messages = {}
+                self._invalid_records = {}
+                for msg_id, record in self._replay_deltas(messages, deltas).items():
+                    try:
+                        self.scheduled_messages[msg_id] = ScheduledMsg.from_dict(record)
+                    except Exception as e:
+                        # 单条配置无效时只跳过该条的调度，原始配置保留在文件中
+                        self._invalid_records[msg_id] = record
+                        logger.error("跳过无效的定时消息配置 %s: %s", msg_id, e)
+                self._journal_len = len(deltas)
                 logger.info(f"已加载 {len(self.scheduled_messages)} 条定时消息配置")
             else:
-                self.scheduled_messages = []
-                await self.save_config()
+                self.scheduled_messages = {}
+                await asyncio.to_thread(self._sync_write_snapshot, [])
         except Exception as e:
             logger.error(f"加载配置失败: {e}")
-            self.scheduled_messages = []
+            self.scheduled_messages = {}
+            self._invalid_records = {}
     
     async def save_config(self):
-        """保存定时消息配置"""
+        """保存定时消息配置：追加增量日志，必要时压缩为快照"""
         try:
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(self.scheduled_messages, f, ensure_ascii=False, indent=2)
+            deltas, self._pending_deltas = self._pending_deltas, []
+            if deltas:
+                try:
+                    await asyncio.to_thread(self._sync_append_deltas, deltas)
+                except Exception:
+                    # 写入失败时放回待写队列并由后台任务重试，重放幂等故重复写入无害
+                    self._pending_deltas[:0] = deltas
+                    self.mark_dirty()
+                    raise
+                self._journal_len += len(deltas)
+            await self._compact_if_needed()
         except Exception as e:
             logger.error(f"保存配置失败: {e}")
     
+    def _append_delta(self, op: str, record: dict):
+        """记录一条配置变更，由后台任务批量写入日志"""
+        self._pending_deltas.append({"op": op, "record": record})
+        self.mark_dirty()
+    
+    async def _compact_if_needed(self):
+        """日志条数超过快照的4倍时重写快照并清空日志"""
+        total = len(self.scheduled_messages) + len(self._invalid_records)
+        if self._journal_len <= 4 * max(total, 1):
+            return
+        # 先在事件循环中复制一份快照，再交给工作线程写盘
+        snapshot = [msg.to_dict() for msg in self.scheduled_messages.values()]
+        snapshot.extend(dict(record) for record in self._invalid_records.values())
+        await asyncio.to_thread(self._sync_compact, snapshot)
+        self._journal_len = 0
+    
+    @staticmethod
+    def _replay_deltas(messages: list[dict], deltas: list[dict]) -> dict[str, dict]:
+        """将增量日志按顺序应用到快照上（重复应用结果不变）"""
+        index: dict[str, dict] = {}
+        for msg in messages:
+            if msg['id'] in index:
+                logger.warning("配置中存在重复的消息ID %s，仅保留最后一条", msg['id'])
+            index[msg['id']] = msg
+        for delta in deltas:
+            op = delta.get('op')
+            record = delta.get('record', {})
+            msg_id = record.get('id')
+            if op == 'add':
+                index[msg_id] = record
+            elif op == 'del':
+                index.pop(msg_id, None)
+            elif op == 'toggle' and msg_id in index:
+                index[msg_id]['enabled'] = record.get('enabled', True)
+        return index
+    
+    def _sync_load(self) -> tuple[list[dict], list[dict]]:
+        """在工作线程中读取快照和增量日志"""
+        messages: list[dict] = []
+        if os.path.exists(self.config_file):
+            with open(self.config_file, 'rb') as f:
+                messages = _json_loads(f.read())
+        
+        deltas: list[dict] = []
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, 'rb') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        deltas.append(_json_loads(line))
+                    except ValueError:
+                        # 写入中断留下的残行，跳过
+                        logger.warning("跳过无法解析的配置日志: %r", line[:50])
+        return messages, deltas
+    
+    def _sync_append_deltas(self, deltas: list[dict]):
+        """在工作线程中追加增量日志"""
+        with open(self.journal_file, 'ab') as f:
+            f.write(b''.join(_json_dumps(d) + b'\n' for d in deltas))
+    
+    def _sync_write_snapshot(self, messages: list[dict]):
+        """在工作线程中原子地写入快照文件"""
+        tmp_file = self.config_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(_json_dumps(messages, indent=True))
+        os.replace(tmp_file, self.config_file)
+    
+    def _sync_compact(self, messages: list[dict]):
+        """在工作线程中重写快照并清空增量日志"""
+        self._sync_write_snapshot(messages)
+        open(self.journal_file, 'wb').close()
+    
+    def mark_dirty(self):
+        """标记配置已变更，稍后统一保存"""
+        self._dirty.set()
+    
+    async def _flusher(self):
+        """后台保存任务：将短时间内的多次变更合并为一次写盘"""
+        try:
+            while True:
+                await self._dirty.wait()
+                await asyncio.sleep(0.5)
+                self._dirty.clear()
+                self._save_task = asyncio.create_task(self.save_config())
+                await asyncio.shield(self._save_task)
+        except asyncio.CancelledError:
+            pass
+    
     async def start_all_tasks(self):
         """启动所有定时任务"""
-        for msg_config in self.scheduled_messages:
-            if msg_config.get('enabled', True):
-                await self.start_single_task(msg_config)
-    
-    async def start_single_task(self, msg_config: Dict):
-        """启动单个定时任务"""
-        task_id = msg_config['id']
-        if task_id in self.tasks:
-            self.tasks[task_id].cancel()
+        started: list[str] = []
+        for msg_config in self.scheduled_messages.values():
+            if msg_config.enabled:
+                self.schedule_message(msg_config)
+                started.append(msg_config.id)
+        logger.info("已启动 %d 个定时任务", len(started))
+        if started:
+            logger.debug("已启动的定时任务: %s", ','.join(started))
+        self._scheduler_task = asyncio.create_task(self._scheduler_loop())
+    
+    def _next_fire_time(self, msg_config: ScheduledMsg) -> float:
+        """计算下次执行时间（时间戳），仅用整数时间元组运算，不创建datetime对象"""
+        hour, minute, second = msg_config.clock
+        now = time.time()
+        lt = time.localtime(now)
         
-        self.tasks[task_id] = asyncio.create_task(self.timed_message_loop(msg_config))
-        logger.info(f"已启动定时任务: {task_id}")
+        next_run = time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday, hour, minute, second, 0, 0, -1))
+        if now >= next_run:
+            # mktime会自动处理跨月/跨年的日期进位
+            next_run = time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday + 1, hour, minute, second, 0, 0, -1))
+        return next_run
+    
+    def schedule_message(self, msg_config: ScheduledMsg):
+        """将定时消息加入调度堆"""
+        msg_id = msg_config.id
+        fire_at = self._next_fire_time(msg_config)
+        if msg_id in self._next_fire:
+            self._stale += 1
+        self._next_fire[msg_id] = fire_at
+        heapq.heappush(self._heap, (fire_at, msg_id))
+        self._compact_heap_if_needed()
+        self._wake.set()
+        logger.debug("任务 %s 将在 %.0f 秒后执行", msg_id, fire_at - time.time())
+    
+    def unschedule_message(self, msg_id: str):
+        """取消定时消息的调度，堆中残留的条目在弹出时丢弃"""
+        if self._next_fire.pop(msg_id, None) is not None:
+            self._stale += 1
+            self._compact_heap_if_needed()
+    
+    def _compact_heap_if_needed(self):
+        """失效条目超过堆的一半时按有效调度重建堆"""
+        if self._stale * 2 <= len(self._heap):
+            return
+        self._heap = [(fire_at, msg_id) for msg_id, fire_at in self._next_fire.items()]
+        heapq.heapify(self._heap)
+        self._stale = 0
     
-    async def timed_message_loop(self, msg_config: Dict):
-        """定时消息循环"""
+    async def _scheduler_loop(self):
+        """调度循环：等待最早的定时消息到期后发送"""
         try:
             while True:
-                now = datetime.now()
-                target_time = time.fromisoformat(msg_config['time'])
-                current_time = now.time()
+                self._wake.clear()
+                if not self._heap:
+                    await self._wake.wait()
+                    continue
                 
-                # 计算下次执行时间
-                next_run = datetime.combine(now.date(), target_time)
-                if current_time >= target_time:
-                    next_run = datetime.combine((now + timedelta(days=1)).date(), target_time)
+                # 按墙上时钟重新计算剩余时间，临近截止时逐步减半等待，
+                # 避免主机休眠或单调时钟漂移导致触发时间偏差
+                delay = self._heap[0][0] - time.time()
+                if delay > 0:
+                    # 用定时回调唤醒而非 asyncio.wait_for：后者在事件恰好被置位时
+                    # 可能吞掉取消请求，导致 terminate 一直等待调度任务退出
+                    timer = asyncio.get_running_loop().call_later(
+                        delay / 2 if delay > 1 else delay, self._wake.set
+                    )
+                    try:
+                        await self._wake.wait()
+                    finally:
+                        timer.cancel()
+                    continue
                 
-                # 等待到执行时间
-                wait_seconds = (next_run - now).total_seconds()
-                logger.info(f"任务 {msg_config['id']} 将在 {wait_seconds:.0f} 秒后执行")
-                await asyncio.sleep(wait_seconds)
+                fire_at, msg_id = heapq.heappop(self._heap)
+                if self._next_fire.get(msg_id) != fire_at:
+                    # 已删除、禁用或被重新调度
+                    self._stale -= 1
+                    continue
+                del self._next_fire[msg_id]
+                msg_config = self.scheduled_messages.get(msg_id)
+                if msg_config is None:
+                    continue
                 
-                # 发送消息
-                await self.send_timed_message(msg_config)
+                task = asyncio.create_task(self.send_timed_message(msg_config))
+                self._send_tasks.add(task)
+                task.add_done_callback(self._send_tasks.discard)
+                self.schedule_message(msg_config)
                 
         except asyncio.CancelledError:
-            logger.info(f"定时任务 {msg_config['id']} 已取消")
+            logger.info("定时消息调度已取消")
         except Exception as e:
-            logger.error(f"定时任务 {msg_config['id']} 执行出错: {e}")
+            logger.error("定时消息调度出错: %s", e)
     
-    async def send_timed_message(self, msg_config: Dict):
+    async def send_timed_message(self, msg_config: ScheduledMsg):
         """发送定时消息"""
         try:
-            group_id = msg_config['group_id']
-            message = msg_config['message']
+            group_id = msg_config.group_id
+            message = msg_config.message
             
-            # 使用AstrBot的消息发送API
-            # 这里使用简化的方式，实际使用时需要根据AstrBot的具体API调整
-            logger.info(f"发送定时消息到群 {group_id}: {message}")
-            # 注意：这里需要根据实际的AstrBot API来实现消息发送
-            # 由于不确定具体的API，这里只记录日志
+            lock = self._group_locks.get(group_id)
+            if lock is None:
+                lock = self._group_locks[group_id] = asyncio.Lock()
+            self._group_lock_users[group_id] = self._group_lock_users.get(group_id, 0) + 1
+            try:
+                async with lock, self._send_sem:
+                    # 使用AstrBot的消息发送API
+                    # 这里使用简化的方式，实际使用时需要根据AstrBot的具体API调整
+                    logger.info(f"发送定时消息到群 {group_id}: {message}")
+                    # 注意：这里需要根据实际的AstrBot API来实现消息发送
+                    # 由于不确定具体的API，这里只记录日志
+            finally:
+                # 没有其他发送在使用该群的锁时将其清理
+                users = self._group_lock_users[group_id] - 1
+                if users:
+                    self._group_lock_users[group_id] = users
+                else:
+                    del self._group_lock_users[group_id]
+                    del self._group_locks[group_id]
                 
         except Exception as e:
             logger.error(f"发送定时消息失败: {e}")
@@ -106,36 +370,38 @@ class TimedMessagePlugin(Star):
         示例: /add_timed_msg 123456789 09:00 早上好，新的一天开始了！
         """
         try:
-            args = event.message_str.split(' ', 3)
-            if len(args) < 4:
+            m = _ADD_RE.match(event.message_str)
+            if not m:
                 yield event.plain_result("用法: /add_timed_msg <群号> <时间(HH:MM)> <消息内容>")
                 return
             
-            group_id = args[1]
-            time_str = args[2]
-            message = args[3]
+            group_id, time_str, message = m.groups()
             
             # 验证时间格式
-            try:
-                time.fromisoformat(time_str)
-            except ValueError:
+            if not _TIME_RE.match(time_str):
                 yield event.plain_result("时间格式错误，请使用 HH:MM 格式，如 09:00")
                 return
             
             # 创建新的定时消息配置
-            msg_id = f"msg_{len(self.scheduled_messages) + 1}_{int(datetime.now().timestamp())}"
-            new_config = {
-                "id": msg_id,
-                "group_id": group_id,
-                "time": time_str,
-                "message": message,
-                "enabled": True,
-                "created_at": datetime.now().isoformat()
-            }
+            now = datetime.now()
+            base_id = f"msg_{len(self.scheduled_messages) + 1}_{int(now.timestamp())}"
+            # 删除后再添加时计数可能与已有消息重复，追加序号确保ID唯一
+            msg_id, suffix = base_id, 1
+            while msg_id in self.scheduled_messages or msg_id in self._invalid_records:
+                suffix += 1
+                msg_id = f"{base_id}_{suffix}"
+            new_config = ScheduledMsg(
+                id=msg_id,
+                group_id=group_id,
+                time=time_str,
+                message=message,
+                enabled=True,
+                created_at=now.isoformat(),
+            )
             
-            self.scheduled_messages.append(new_config)
-            await self.save_config()
-            await self.start_single_task(new_config)
+            self.scheduled_messages[msg_id] = new_config
+            self._append_delta('add', new_config.to_dict())
+            self.schedule_message(new_config)
             
             yield event.plain_result(f"定时消息添加成功！\nID: {msg_id}\n群号: {group_id}\n时间: {time_str}\n消息: {message}")
             
@@ -146,20 +412,33 @@ class TimedMessagePlugin(Star):
     @filter.command("list_timed_msg")
     async def list_timed_messages(self, event: AstrMessageEvent):
         """列出所有定时消息"""
-        if not self.scheduled_messages:
+        if not self.scheduled_messages and not self._invalid_records:
             yield event.plain_result("当前没有配置任何定时消息")
             return
         
-        result = "当前配置的定时消息:\n"
-        for i, msg in enumerate(self.scheduled_messages, 1):
-            status = "启用" if msg.get('enabled', True) else "禁用"
-            result += f"{i}. ID: {msg['id']}\n"
-            result += f"   群号: {msg['group_id']}\n"
-            result += f"   时间: {msg['time']}\n"
-            result += f"   消息: {msg['message'][:50]}{'...' if len(msg['message']) > 50 else ''}\n"
-            result += f"   状态: {status}\n\n"
+        parts: list[str] = ["当前配置的定时消息:\n"]
+        append = parts.append
+        for i, msg in enumerate(self.scheduled_messages.values(), 1):
+            text = msg.message
+            status = "启用" if msg.enabled else "禁用"
+            append(
+                f"{i}. ID: {msg.id}\n"
+                f"   群号: {msg.group_id}\n"
+                f"   时间: {msg.time}\n"
+                f"   消息: {text if len(text) <= 50 else text[:50] + '...'}\n"
+                f"   状态: {status}\n\n"
+            )
+        for i, record in enumerate(self._invalid_records.values(), len(self.scheduled_messages) + 1):
+            text = str(record.get('message', ''))
+            append(
+                f"{i}. ID: {record.get('id')}\n"
+                f"   群号: {record.get('group_id', '')}\n"
+                f"   时间: {record.get('time', '')}\n"
+                f"   消息: {text if len(text) <= 50 else text[:50] + '...'}\n"
+                f"   状态: 配置无效\n\n"
+            )
         
-        yield event.plain_result(result)
+        yield event.plain_result(''.join(parts))
     
     @filter.command("del_timed_msg")
     async def delete_timed_message(self, event: AstrMessageEvent):
@@ -167,29 +446,18 @@ class TimedMessagePlugin(Star):
         用法: /del_timed_msg <消息ID>
         """
         try:
-            args = event.message_str.split(' ', 1)
-            if len(args) < 2:
+            m = _DEL_RE.match(event.message_str)
+            if not m:
                 yield event.plain_result("用法: /del_timed_msg <消息ID>")
                 return
             
-            msg_id = args[1]
+            msg_id = m.group(1)
             
-            # 查找并删除消息
-            found = False
-            for i, msg in enumerate(self.scheduled_messages):
-                if msg['id'] == msg_id:
-                    # 取消任务
-                    if msg_id in self.tasks:
-                        self.tasks[msg_id].cancel()
-                        del self.tasks[msg_id]
-                    
-                    # 从配置中删除
-                    del self.scheduled_messages[i]
-                    await self.save_config()
-                    found = True
-                    break
-            
-            if found:
+            # 从配置中删除并取消调度
+            if (self.scheduled_messages.pop(msg_id, None) is not None
+                    or self._invalid_records.pop(msg_id, None) is not None):
+                self.unschedule_message(msg_id)
+                self._append_delta('del', {"id": msg_id})
                 yield event.plain_result(f"定时消息 {msg_id} 已删除")
             else:
                 yield event.plain_result(f"未找到ID为 {msg_id} 的定时消息")
@@ -204,33 +472,28 @@ class TimedMessagePlugin(Star):
         用法: /toggle_timed_msg <消息ID>
         """
         try:
-            args = event.message_str.split(' ', 1)
-            if len(args) < 2:
+            m = _TOGGLE_RE.match(event.message_str)
+            if not m:
                 yield event.plain_result("用法: /toggle_timed_msg <消息ID>")
                 return
             
-            msg_id = args[1]
-            
-            # 查找并切换状态
-            found = False
-            for msg in self.scheduled_messages:
-                if msg['id'] == msg_id:
-                    msg['enabled'] = not msg.get('enabled', True)
-                    await self.save_config()
-                    
-                    if msg['enabled']:
-                        await self.start_single_task(msg)
-                        yield event.plain_result(f"定时消息 {msg_id} 已启用")
-                    else:
-                        if msg_id in self.tasks:
-                            self.tasks[msg_id].cancel()
-                            del self.tasks[msg_id]
-                        yield event.plain_result(f"定时消息 {msg_id} 已禁用")
-                    found = True
-                    break
+            msg_id = m.group(1)
             
-            if not found:
+            msg = self.scheduled_messages.get(msg_id)
+            if msg is None:
                 yield event.plain_result(f"未找到ID为 {msg_id} 的定时消息")
+                return
+            
+            # 切换状态
+            msg.enabled = not msg.enabled
+            self._append_delta('toggle', {"id": msg_id, "enabled": msg.enabled})
+            
+            if msg.enabled:
+                self.schedule_message(msg)
+                yield event.plain_result(f"定时消息 {msg_id} 已启用")
+            else:
+                self.unschedule_message(msg_id)
+                yield event.plain_result(f"定时消息 {msg_id} 已禁用")
                 
         except Exception as e:
             logger.error(f"切换定时消息状态失败: {e}")
@@ -238,6 +501,16 @@ class TimedMessagePlugin(Star):
     
     async def terminate(self):
         """插件终止时取消所有任务"""
-        for task in self.tasks.values():
+        tasks = [t for t in (self._scheduler_task, self._flusher_task) if t is not None]
+        tasks.extend(self._send_tasks)
+        for task in tasks:
             task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        
+        # 等待进行中的写盘结束后再做最后一次保存，避免两个线程同时写日志
+        if self._save_task is not None:
+            await asyncio.gather(self._save_task, return_exceptions=True)
+        if self._pending_deltas:
+            self._dirty.clear()
+            await self.save_config()
         logger.info("定时消息插件已终止，所有任务已取消")